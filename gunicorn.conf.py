@@ -0,0 +1,15 @@
+"""
+Gunicorn settings for production
+
+Run with: gunicorn main:app -c gunicorn.conf.py
+UvicornWorker picks uvloop and httptools automatically when they are installed (uvicorn[standard]).
+"""
+import multiprocessing
+import os
+
+bind = os.getenv("BIND", "0.0.0.0:8000")
+workers = int(os.getenv("WEB_CONCURRENCY", multiprocessing.cpu_count()))
+worker_class = "uvicorn.workers.UvicornWorker"
+# LLM calls can take a while; don't let the arbiter kill workers mid-generation
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "120"))
+keepalive = 5
@@ -1,30 +1,124 @@
+import asyncio
+import logging
 import os
-from typing import List, Optional, Literal, Dict, Any
-from fastapi import FastAPI, HTTPException
+import re
+from contextlib import asynccontextmanager
+from functools import lru_cache
+from string import Template
+from urllib.parse import quote
+from typing import Annotated, List, Optional, Literal, Dict, Any
+from fastapi import FastAPI, HTTPException, Request, Depends, BackgroundTasks
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel, Field
+from fastapi.encoders import jsonable_encoder
+from fastapi.exceptions import RequestValidationError
+from fastapi.responses import JSONResponse, ORJSONResponse, Response
+from fastapi_cache import FastAPICache
+from fastapi_cache.coder import Coder
+from fastapi_cache.backends.inmemory import InMemoryBackend
+from fastapi_cache.backends.redis import RedisBackend
+from fastapi_cache.decorator import cache
+from pydantic import BaseModel, Field, TypeAdapter
+from redis import asyncio as aioredis
 from bson import ObjectId
+from pymongo import ReturnDocument, WriteConcern
+from pymongo.errors import OperationFailure, PyMongoError
+import orjson
 
-from database import db, create_document, get_documents
+import database
+from database import create_document, get_documents
+
+logger = logging.getLogger(__name__)
 
 # Optional OpenAI import guarded at runtime
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 try:
-    from openai import OpenAI  # type: ignore
-    openai_client = OpenAI(api_key=OPENAI_API_KEY) if OPENAI_API_KEY else None
+    from openai import AsyncOpenAI  # type: ignore
+    openai_client = AsyncOpenAI(api_key=OPENAI_API_KEY) if OPENAI_API_KEY else None
 except Exception:
     openai_client = None
 
-app = FastAPI(title="ChapterSmith AI – Complete Story Builder")
+# Response cache: Redis when REDIS_URL is set, otherwise disabled (a per-process cache would
+# keep serving stale reads on the other workers after a write)
+REDIS_URL = os.getenv("REDIS_URL")
+CACHE_PREFIX = "chaptersmith"
+# Project documents read on the generation path; only cached when Redis is shared by all workers
+PROJECT_DOC_TTL = 300
+redis_client = None
+
+class ORJsonCoder(Coder):
+    """fastapi-cache coder using orjson, matching the app's response encoding"""
+
+    @classmethod
+    def encode(cls, value: Any) -> bytes:
+        if isinstance(value, JSONResponse):
+            return value.body
+        return orjson.dumps(jsonable_encoder(value))
+
+    @classmethod
+    def decode(cls, value: bytes) -> Any:
+        return orjson.loads(value)
+
+async def ensure_chapter_index(db):
+    # Chapter lookups and number-ordered listings are served by this index
+    try:
+        await db["chapter"].create_index(
+            [("project_id", 1), ("number", 1)], unique=True
+        )
+    except OperationFailure as e:
+        # Most likely duplicate (project_id, number) rows left by older releases; serve without the index
+        logger.error("Could not create unique chapter index (deduplicate the chapter collection): %s", e)
+    except PyMongoError as e:
+        logger.error("Could not create unique chapter index (database unreachable?): %s", e)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global redis_client
+    # Async Mongo client lives for the lifetime of the app
+    app.state.db = database.connect()
+    # Built in the background so an unreachable Mongo does not block or fail startup
+    index_task = asyncio.create_task(ensure_chapter_index(app.state.db)) if app.state.db is not None else None
+    if REDIS_URL:
+        redis_client = aioredis.from_url(REDIS_URL)
+        FastAPICache.init(RedisBackend(redis_client), prefix=CACHE_PREFIX, coder=ORJsonCoder)
+    else:
+        FastAPICache.init(InMemoryBackend(), prefix=CACHE_PREFIX, coder=ORJsonCoder, enable=False)
+    yield
+    if index_task is not None:
+        index_task.cancel()
+    if redis_client is not None:
+        await redis_client.close()
+        redis_client = None
+    database.close()
+
+app = FastAPI(
+    title="ChapterSmith AI – Complete Story Builder",
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse,
+)
+
+# Credentialed CORS needs explicit origins; comma-separate to allow several frontends
+FRONTEND_ORIGINS = [o.strip() for o in os.getenv("FRONTEND_ORIGIN", "http://localhost:3000").split(",") if o.strip()]
 
 app.add_middleware(
     CORSMiddleware,
-    allow_origins=["*"],
+    allow_origins=FRONTEND_ORIGINS,
     allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
+    allow_methods=["GET", "POST", "PUT", "DELETE"],
+    allow_headers=["Content-Type", "Authorization"],
+    expose_headers=["Content-Disposition"],
+    max_age=86400,
 )
 
+@app.middleware("http")
+async def server_side_cache_only(request: Request, call_next):
+    # fastapi-cache2 advertises max-age and a per-process ETag on cached routes; browsers would then
+    # skip the server and miss invalidations, so keep caching in Redis only
+    response = await call_next(request)
+    if "X-FastAPI-Cache" in response.headers:
+        response.headers["Cache-Control"] = "no-cache"
+        del response.headers["ETag"]
+    return response
+
 # ---------------------------
 # Utility
 # ---------------------------
@@ -37,6 +131,142 @@ def to_str_id(doc: Dict[str, Any]):
         d["id"] = str(d.pop("_id"))
     return d
 
+_WORD_RE = re.compile(r"\S+")
+
+def count_words(text: Optional[str]) -> int:
+    # Count matches without materializing a list of word strings
+    if not text:
+        return 0
+    return sum(1 for _ in _WORD_RE.finditer(text))
+
+# Chapter listing never needs the (large) content field
+CHAPTER_META_PROJECTION = {"_id": 0, "number": 1, "title": 1, "pov_used": 1, "status": 1, "word_count": 1}
+
+@lru_cache(maxsize=1024)
+def _oid(value: str) -> ObjectId:
+    # Parsed ids are reused across the requests of an editing session
+    return ObjectId(value)
+
+# Placeholder chapter rows are cheap to recreate, so skip waiting on the journal for them
+PLACEHOLDER_WRITE_CONCERN = WriteConcern(w=1, j=False)
+
+def get_db(request: Request):
+    return request.app.state.db
+
+def cache_key(namespace: str, name: str, project_id: Optional[str] = None) -> str:
+    return f"{namespace}:{project_id}:{name}" if project_id else f"{namespace}:{name}"
+
+def project_key_builder(func, namespace: str = "", *, request=None, response=None, args=(), kwargs=None):
+    # Fixed, per-project keys so writes can delete exactly the entries they affect (no KEYS scans)
+    return cache_key(namespace, func.__name__, (kwargs or {}).get("project_id"))
+
+def project_doc_key(project_id: str) -> str:
+    return f"{CACHE_PREFIX}:project-doc:{project_id}"
+
+# Only JSON-native fields, so a Redis hit and a Mongo read return the same dict
+PROJECT_DOC_PROJECTION = {"title": 1, "outline": 1, "chapter_count": 1, "pov_mode": 1, "genre": 1}
+
+async def load_project(db, project_id: str) -> Optional[Dict[str, Any]]:
+    """Fetch a project (with string "id"), served from Redis when it is configured and reachable"""
+    key = project_doc_key(project_id)
+    if redis_client is not None:
+        try:
+            cached = await redis_client.get(key)
+            if cached:
+                return orjson.loads(cached)
+        except Exception:
+            logger.exception("Project cache read failed for %s", key)
+    doc = to_str_id(await db["project"].find_one({"_id": _oid(project_id)}, projection=PROJECT_DOC_PROJECTION))
+    if doc and redis_client is not None:
+        try:
+            await redis_client.set(key, orjson.dumps(doc), ex=PROJECT_DOC_TTL)
+        except Exception:
+            logger.exception("Project cache write failed for %s", key)
+    return doc
+
+async def drop_cached(*keys: str):
+    """Delete response-cache entries; a cache outage must not fail a write that already committed"""
+    if not FastAPICache.get_enable():
+        return
+    backend = FastAPICache.get_backend()
+    try:
+        for key in keys:
+            await backend.clear(key=key)
+    except Exception:
+        logger.exception("Response cache invalidation failed for %s", keys)
+
+async def invalidate_project(project_id: Optional[str] = None):
+    """Drop cached project reads, and the cached document of project_id if given"""
+    namespace = f"{CACHE_PREFIX}:projects"
+    keys = [cache_key(namespace, "list_projects")]
+    if project_id:
+        keys.append(cache_key(namespace, "get_project", project_id))
+    await drop_cached(*keys)
+    if project_id and redis_client is not None:
+        try:
+            await redis_client.delete(project_doc_key(project_id))
+        except Exception:
+            logger.exception("Project cache invalidation failed for %s", project_id)
+
+async def invalidate_chapters(project_id: str):
+    await drop_cached(cache_key(f"{CACHE_PREFIX}:chapters", "list_chapters", project_id))
+
+# ---------------------------
+# Prompt building blocks (static, built once at import)
+# ---------------------------
+
+WORD_RULE = (
+    "Each chapter must be strictly between 1400 and 1800 words. "
+    "Do not write less than 1400 words, and do not exceed 1800 words. "
+    "Ensure the chapter feels complete and cohesive while staying within this word count."
+)
+
+POV_RULES = {
+    pov: f"Use deep first-person POV from the {pov} lead’s perspective, staying close to their thoughts, emotions, and physical sensations. Always use 'I', 'my', and 'me' for reactions."
+    for pov in ("female", "male")
+}
+
+STYLE_RULES = (
+    "Write in a clear, grounded, human tone. Avoid poetic or metaphor-heavy language, fragments, and clichés. "
+    "Mix short and long sentences naturally, maintain smooth pacing, start with tension/action/dialogue, end with an emotional hook. "
+    "Balance action with internal monologue. Show through concrete sensory detail without dramatized phrasing. "
+    "Dialogue must be natural and reveal subtext through behavior and tone, not labels. "
+    "No metaphors or flowery imagery unless absolutely necessary for character voice. "
+    "Avoid contractions if that supports clarity (e.g., 'I had', 'He did not')."
+)
+
+GENRE_BLOCKS = {
+    "billionaire": (
+        "Billionaire Romance focus: wealth, control, power imbalance, luxury vs loneliness; high sexual tension with higher emotional stakes. "
+        "Hero commanding yet complex; heroine torn between independence and desire.\n"
+    ),
+    "werewolf": (
+        "Werewolf Romance focus: primal instinct, pack politics, destiny, protective alpha balancing dominance with tenderness.\n"
+    ),
+    "mafia": (
+        "Mafia Romance focus: danger, loyalty, obsession, crime secrecy, and trust issues; dark but human.\n"
+    ),
+    "general": "",
+}
+
+CONTINUITY_RULES = "\n".join((
+    "Maintain continuity with previous chapters; smooth transitions; no abrupt time jumps.",
+    "Every chapter opens with immediate tension/action/dialogue and ends with a strong emotional beat or hook.",
+))
+
+USER_PROMPT_TEMPLATE = Template("""\
+You are writing Chapter $number of a $chapter_count chapter story.
+POV Mode: $pov_mode (resolved to $resolved for this chapter)
+Genre: $genre
+
+Outline/Foundation for this chapter:
+$outline
+
+Write the full chapter now. Output only:
+1) Chapter Title (single line)
+2) Chapter Text (1400–1800 words)
+3) Ensure natural, grounded first-person narration from the $resolved lead. Keep tone human and emotionally authentic.""")
+
 # ---------------------------
 # Schemas (API I/O)
 # ---------------------------
@@ -71,12 +301,37 @@ class ChapterMeta(BaseModel):
     status: Literal["pending","generated","edited","error"] = "pending"
     word_count: Optional[int] = None
 
+CHAPTER_META_LIST = TypeAdapter(List[ChapterMeta])
+
+# Checked in the handlers rather than as Literal fields on the hot generation request
+_VALID_POVS = frozenset({"female", "male"})
+_VALID_PROVIDERS = frozenset({"openai"})
+
+def check_generate_request(payload: "GenerateChapterRequest"):
+    """Reject bad override_pov/provider with the same 422 body pydantic would produce"""
+    errors = []
+    for field, value, allowed in (
+        ("override_pov", payload.override_pov, _VALID_POVS),
+        ("provider", payload.provider, _VALID_PROVIDERS),
+    ):
+        if value is not None and value not in allowed:
+            expected = " or ".join(f"'{v}'" for v in sorted(allowed))
+            errors.append({
+                "type": "literal_error",
+                "loc": ("body", field),
+                "msg": f"Input should be {expected}",
+                "input": value,
+                "ctx": {"expected": expected},
+            })
+    if errors:
+        raise RequestValidationError(errors)
+
 class GenerateChapterRequest(BaseModel):
     project_id: str
-    number: int
+    number: Annotated[int, Field(ge=1)]
     outline_hint: Optional[str] = None
-    override_pov: Optional[Literal["female","male"]] = None
-    provider: Optional[Literal["openai"]] = "openai"
+    override_pov: Optional[str] = None
+    provider: Optional[str] = "openai"
     model: Optional[str] = Field(default="gpt-4o-mini")
     temperature: Optional[float] = Field(default=0.7, ge=0.0, le=2.0)
 
@@ -92,11 +347,12 @@ class SaveChapterRequest(BaseModel):
 # ---------------------------
 
 @app.get("/")
-def read_root():
+async def read_root():
     return {"message": "ChapterSmith AI backend running"}
 
 @app.get("/test")
-def test_database():
+@cache(expire=30, namespace="health")
+async def test_database(db=Depends(get_db)):
     response = {
         "backend": "✅ Running",
         "database": "❌ Not Available",
@@ -113,7 +369,7 @@ def test_database():
             response["database_name"] = "✅ Set" if os.getenv("DATABASE_NAME") else "❌ Not Set"
             response["connection_status"] = "Connected"
             try:
-                collections = db.list_collection_names()
+                collections = await db.list_collection_names()
                 response["collections"] = collections[:10]
             except Exception as e:
                 response["database"] = f"⚠️  Connected but Error: {str(e)[:80]}"
@@ -128,63 +384,70 @@ def test_database():
 # ---------------------------
 
 @app.post("/api/projects", response_model=ProjectResponse)
-def create_project(payload: CreateProjectRequest):
-    data = payload.model_dump()
-    project_id = create_document("project", data)
-    doc = db["project"].find_one({"_id": ObjectId(project_id)})
-    return to_str_id(doc)
+async def create_project(payload: CreateProjectRequest, db=Depends(get_db)):
+    data = payload.model_dump(exclude_none=True)
+    project_id = await create_document("project", data)
+    # The inserted fields are already in hand; no need to read the document back
+    data["id"] = project_id
+    await invalidate_project()
+    return data
 
 @app.get("/api/projects", response_model=List[ProjectResponse])
-def list_projects():
-    docs = get_documents("project")
+@cache(expire=60, namespace="projects", key_builder=project_key_builder)
+async def list_projects():
+    docs = await get_documents("project")
     return [to_str_id(d) for d in docs]
 
 @app.get("/api/projects/{project_id}", response_model=ProjectResponse)
-def get_project(project_id: str):
-    doc = db["project"].find_one({"_id": ObjectId(project_id)})
+@cache(expire=60, namespace="projects", key_builder=project_key_builder)
+async def get_project(project_id: str, db=Depends(get_db)):
+    doc = await db["project"].find_one({"_id": _oid(project_id)})
     if not doc:
         raise HTTPException(status_code=404, detail="Project not found")
     return to_str_id(doc)
 
 @app.put("/api/projects/{project_id}", response_model=ProjectResponse)
-def update_project(project_id: str, payload: UpdateProjectRequest):
-    updates = {k: v for k, v in payload.model_dump().items() if v is not None}
+async def update_project(project_id: str, payload: UpdateProjectRequest, db=Depends(get_db)):
+    updates = payload.model_dump(exclude_none=True)
     if not updates:
-        doc = db["project"].find_one({"_id": ObjectId(project_id)})
+        doc = await db["project"].find_one({"_id": _oid(project_id)})
         if not doc:
             raise HTTPException(status_code=404, detail="Project not found")
         return to_str_id(doc)
-    db["project"].update_one({"_id": ObjectId(project_id)}, {"$set": updates})
-    doc = db["project"].find_one({"_id": ObjectId(project_id)})
+    doc = await db["project"].find_one_and_update(
+        {"_id": _oid(project_id)},
+        {"$set": updates},
+        return_document=ReturnDocument.AFTER,
+    )
     if not doc:
         raise HTTPException(status_code=404, detail="Project not found")
+    await invalidate_project(project_id)
     return to_str_id(doc)
 
 @app.delete("/api/projects/{project_id}")
-def delete_project(project_id: str):
-    # delete project and its chapters
-    db["project"].delete_one({"_id": ObjectId(project_id)})
-    db["chapter"].delete_many({"project_id": project_id})
+async def delete_project(project_id: str, db=Depends(get_db)):
+    # delete project and its chapters concurrently (different collections, no shared state)
+    await asyncio.gather(
+        db["project"].delete_one({"_id": _oid(project_id)}),
+        db["chapter"].delete_many({"project_id": project_id}),
+    )
+    await invalidate_project(project_id)
+    await invalidate_chapters(project_id)
     return {"ok": True}
 
 @app.get("/api/projects/{project_id}/chapters", response_model=List[ChapterMeta])
-def list_chapters(project_id: str):
-    docs = db["chapter"].find({"project_id": project_id}).sort("number", 1)
-    res = []
-    for d in docs:
-        res.append(ChapterMeta(
-            project_id=project_id,
-            number=d.get("number"),
-            title=d.get("title"),
-            pov_used=d.get("pov_used"),
-            status=d.get("status", "pending"),
-            word_count=d.get("word_count")
-        ))
-    return res
+@cache(expire=60, namespace="chapters", key_builder=project_key_builder)
+async def list_chapters(project_id: str, db=Depends(get_db)):
+    docs = db["chapter"].find(
+        {"project_id": project_id},
+        projection=CHAPTER_META_PROJECTION,
+    ).sort("number", 1)
+    # Projected docs carry only ChapterMeta fields; validate the whole list in one call
+    return CHAPTER_META_LIST.validate_python([{"project_id": project_id, **d} async for d in docs])
 
 @app.get("/api/projects/{project_id}/chapters/{number}")
-def get_chapter(project_id: str, number: int):
-    ch = db["chapter"].find_one({"project_id": project_id, "number": number})
+async def get_chapter(project_id: str, number: int, db=Depends(get_db)):
+    ch = await db["chapter"].find_one({"project_id": project_id, "number": number})
     if not ch:
         raise HTTPException(status_code=404, detail="Chapter not found")
     ch = to_str_id(ch)
@@ -199,26 +462,33 @@ def get_chapter(project_id: str, number: int):
     }
 
 @app.delete("/api/projects/{project_id}/chapters/{number}")
-def delete_chapter(project_id: str, number: int):
-    db["chapter"].delete_one({"project_id": project_id, "number": number})
+async def delete_chapter(project_id: str, number: int, db=Depends(get_db)):
+    await db["chapter"].delete_one({"project_id": project_id, "number": number})
+    await invalidate_chapters(project_id)
     return {"ok": True}
 
 @app.post("/api/chapters/save")
-def save_chapter(payload: SaveChapterRequest):
+async def save_chapter(payload: SaveChapterRequest, db=Depends(get_db)):
     # Enforce word count if provided
-    wc = len(payload.content.split()) if payload.content else 0
-    existing = db["chapter"].find_one({"project_id": payload.project_id, "number": payload.number})
-    db["chapter"].update_one(
+    wc = count_words(payload.content)
+    # Single round trip: a pipeline update decides edited/generated from the stored content.
+    # Client values are wrapped in $literal so user text starting with "$" is not read as a field path.
+    await db["chapter"].update_one(
         {"project_id": payload.project_id, "number": payload.number},
-        {"$set": {
-            "title": payload.title,
-            "content": payload.content,
-            "pov_used": payload.pov_used,
-            "status": "edited" if existing and existing.get("content") else "generated",
+        [{"$set": {
+            "title": {"$literal": payload.title},
+            "content": {"$literal": payload.content},
+            "pov_used": {"$literal": payload.pov_used},
+            "status": {"$cond": [
+                {"$gt": [{"$ifNull": ["$content", ""]}, ""]},
+                "edited",
+                "generated",
+            ]},
             "word_count": wc
-        }},
+        }}],
         upsert=True
     )
+    await invalidate_chapters(payload.project_id)
     return {"ok": True, "word_count": wc}
 
 # Placeholder generation route (no external LLM). It returns a structured prompt and guidance
@@ -230,16 +500,12 @@ class GenerationPlan(BaseModel):
     system_rules: str
     user_prompt: str
 
-@app.post("/api/chapters/prepare", response_model=GenerationPlan)
-def prepare_chapter_generation(payload: GenerateChapterRequest):
-    project = db["project"].find_one({"_id": ObjectId(payload.project_id)})
-    if not project:
-        raise HTTPException(status_code=404, detail="Project not found")
-
+def _build_plan(project: Dict[str, Any], payload: GenerateChapterRequest) -> GenerationPlan:
+    """Resolve POV and assemble the prompt for an already-fetched project (no I/O)"""
     # POV resolution logic
     pov_mode = project.get("pov_mode", "female")
     resolved: Literal["female","male"]
-    if payload.override_pov in ("female","male"):
+    if payload.override_pov in _VALID_POVS:
         resolved = payload.override_pov
     elif pov_mode == "female":
         resolved = "female"
@@ -248,87 +514,59 @@ def prepare_chapter_generation(payload: GenerateChapterRequest):
     else:  # dual
         resolved = "female" if (payload.number % 2 == 1) else "male"
 
-    # Build rules and prompt
-    word_rule = (
-        "Each chapter must be strictly between 1400 and 1800 words. "
-        "Do not write less than 1400 words, and do not exceed 1800 words. "
-        "Ensure the chapter feels complete and cohesive while staying within this word count."
-    )
-
-    pov_rule = f"Use deep first-person POV from the {resolved} lead’s perspective, staying close to their thoughts, emotions, and physical sensations. Always use 'I', 'my', and 'me' for reactions."
-
-    style_rules = (
-        "Write in a clear, grounded, human tone. Avoid poetic or metaphor-heavy language, fragments, and clichés. "
-        "Mix short and long sentences naturally, maintain smooth pacing, start with tension/action/dialogue, end with an emotional hook. "
-        "Balance action with internal monologue. Show through concrete sensory detail without dramatized phrasing. "
-        "Dialogue must be natural and reveal subtext through behavior and tone, not labels. "
-        "No metaphors or flowery imagery unless absolutely necessary for character voice. "
-        "Avoid contractions if that supports clarity (e.g., 'I had', 'He did not')."
-    )
-
     genre_hint = project.get("genre", "general")
-    genre_block = ""
-    if genre_hint == "billionaire":
-        genre_block = (
-            "Billionaire Romance focus: wealth, control, power imbalance, luxury vs loneliness; high sexual tension with higher emotional stakes. "
-            "Hero commanding yet complex; heroine torn between independence and desire.\n"
-        )
-    elif genre_hint == "werewolf":
-        genre_block = (
-            "Werewolf Romance focus: primal instinct, pack politics, destiny, protective alpha balancing dominance with tenderness.\n"
-        )
-    elif genre_hint == "mafia":
-        genre_block = (
-            "Mafia Romance focus: danger, loyalty, obsession, crime secrecy, and trust issues; dark but human.\n"
-        )
-
     outline = payload.outline_hint or project.get("outline", "")
 
-    system_rules = "\n".join([
-        word_rule,
-        pov_rule,
-        style_rules,
-        genre_block,
-        "Maintain continuity with previous chapters; smooth transitions; no abrupt time jumps.",
-        "Every chapter opens with immediate tension/action/dialogue and ends with a strong emotional beat or hook.",
-    ])
+    system_rules = "\n".join((
+        WORD_RULE,
+        POV_RULES[resolved],
+        STYLE_RULES,
+        GENRE_BLOCKS.get(genre_hint, ""),
+        CONTINUITY_RULES,
+    ))
 
     title = f"Chapter {payload.number}"
 
-    user_prompt = f"""
-You are writing Chapter {payload.number} of a {project.get('chapter_count')} chapter story.
-POV Mode: {project.get('pov_mode')} (resolved to {resolved} for this chapter)
-Genre: {genre_hint}
+    user_prompt = USER_PROMPT_TEMPLATE.substitute(
+        number=payload.number,
+        chapter_count=project.get('chapter_count'),
+        pov_mode=project.get('pov_mode'),
+        resolved=resolved,
+        genre=genre_hint,
+        outline=outline,
+    )
 
-Outline/Foundation for this chapter:
-{outline}
+    return GenerationPlan(
+        chapter_title=title,
+        resolved_pov=resolved,
+        system_rules=system_rules,
+        user_prompt=user_prompt
+    )
 
-Write the full chapter now. Output only:
-1) Chapter Title (single line)
-2) Chapter Text (1400–1800 words)
-3) Ensure natural, grounded first-person narration from the {resolved} lead. Keep tone human and emotionally authentic.
-"""
+@app.post("/api/chapters/prepare", response_model=GenerationPlan)
+async def prepare_chapter_generation(payload: GenerateChapterRequest, db=Depends(get_db)):
+    check_generate_request(payload)
+    project = await load_project(db, payload.project_id)
+    if not project:
+        raise HTTPException(status_code=404, detail="Project not found")
+    plan = _build_plan(project, payload)
 
     # Create/ensure placeholder document for continuity tracking
-    db["chapter"].update_one(
+    await db.get_collection("chapter", write_concern=PLACEHOLDER_WRITE_CONCERN).update_one(
         {"project_id": payload.project_id, "number": payload.number},
         {"$setOnInsert": {
             "project_id": payload.project_id,
             "number": payload.number,
             "status": "pending",
         }, "$set": {
-            "pov_used": resolved,
-            "title": title,
+            "pov_used": plan.resolved_pov,
+            "title": plan.chapter_title,
         }},
         upsert=True
     )
+    await invalidate_chapters(payload.project_id)
 
-    return GenerationPlan(
-        chapter_title=title,
-        resolved_pov=resolved,
-        system_rules=system_rules,
-        user_prompt=user_prompt.strip()
-    )
+    return plan
 
 # ---------------------------
 # In-app AI Generation (OpenAI)
@@ -341,16 +579,54 @@ class GeneratedChapterResponse(BaseModel):
     word_count: int
     status: str
 
+async def persist_generated_chapter(db, project_id: str, number: int, title: Optional[str], content: str, pov_used: str, word_count: int):
+    await db["chapter"].update_one(
+        {"project_id": project_id, "number": number},
+        {"$set": {
+            "title": title,
+            "content": content,
+            "pov_used": pov_used,
+            "status": "generated",
+            "word_count": word_count
+        }, "$unset": {"error": ""}},
+        upsert=True
+    )
+    await invalidate_chapters(project_id)
+
+async def mark_chapter_error(db, project_id: str, number: int, message: str):
+    # Only the failure path waits on this write; chapters that already have text keep their status
+    await db["chapter"].update_one(
+        {"project_id": project_id, "number": number},
+        [{"$set": {
+            "error": {"$literal": message},
+            "status": {"$cond": [
+                {"$gt": [{"$ifNull": ["$content", ""]}, ""]},
+                "$status",
+                "error",
+            ]},
+        }}],
+        upsert=True
+    )
+    await invalidate_chapters(project_id)
+
+# First non-blank line of the model output, and the whitespace around each line break
+_FIRST_LINE_RE = re.compile(r"\S[^\n]*")
+_LINE_EDGE_RE = re.compile(r"[^\S\n]*\n[^\S\n]*")
+
 @app.post("/api/chapters/generate", response_model=GeneratedChapterResponse)
-def generate_chapter(payload: GenerateChapterRequest):
-    # Prepare prompt and rules first
-    plan = prepare_chapter_generation(payload)
+async def generate_chapter(payload: GenerateChapterRequest, background_tasks: BackgroundTasks, db=Depends(get_db)):
+    check_generate_request(payload)
+    # Build the plan from a single project read; the chapter itself is written once, after the LLM returns
+    project = await load_project(db, payload.project_id)
+    if not project:
+        raise HTTPException(status_code=404, detail="Project not found")
+    plan = _build_plan(project, payload)
 
     if payload.provider == "openai":
         if openai_client is None:
             raise HTTPException(status_code=400, detail="OpenAI is not configured. Set OPENAI_API_KEY or use copy/paste flow.")
         try:
-            completion = openai_client.chat.completions.create(
+            completion = await openai_client.chat.completions.create(
                 model=payload.model or "gpt-4o-mini",
                 temperature=payload.temperature or 0.7,
                 messages=[
@@ -360,35 +636,30 @@ def generate_chapter(payload: GenerateChapterRequest):
             )
             text = completion.choices[0].message.content or ""
         except Exception as e:
+            try:
+                await mark_chapter_error(db, payload.project_id, payload.number, str(e)[:200])
+            except Exception:
+                logger.exception("Could not record generation error for %s/%s", payload.project_id, payload.number)
             raise HTTPException(status_code=500, detail=f"OpenAI error: {str(e)[:200]}")
     else:
         raise HTTPException(status_code=400, detail="Unsupported provider")
 
     # Heuristic: first non-empty line as title if it looks like one; rest as content
-    lines = [ln.strip() for ln in (text or "").splitlines()]
     extracted_title = plan.chapter_title
-    cleaned_lines: List[str] = []
-    first_nonempty_index = None
-    for idx, ln in enumerate(lines):
-        if ln:
-            first_nonempty_index = idx
-            extracted_title = ln
-            break
-    if first_nonempty_index is not None:
-        cleaned_lines = lines[first_nonempty_index+1:]
-    final_content = "\n".join(cleaned_lines).strip() if cleaned_lines else text
-
-    wc = len(final_content.split()) if final_content else 0
-    db["chapter"].update_one(
-        {"project_id": payload.project_id, "number": payload.number},
-        {"$set": {
-            "title": extracted_title,
-            "content": final_content,
-            "pov_used": plan.resolved_pov,
-            "status": "generated",
-            "word_count": wc
-        }},
-        upsert=True
+    final_content = text
+    first = _FIRST_LINE_RE.search(text)
+    if first:
+        extracted_title = first.group().strip()
+        rest = text[first.end() + 1:]
+        if rest:
+            # Strip every line of the body in one regex pass instead of splitting into a list
+            final_content = _LINE_EDGE_RE.sub("\n", rest).strip()
+
+    wc = count_words(final_content)
+    # The caller already has the content; store it after the response is sent
+    background_tasks.add_task(
+        persist_generated_chapter,
+        db, payload.project_id, payload.number, extracted_title, final_content, plan.resolved_pov, wc,
     )
 
     return GeneratedChapterResponse(
@@ -404,18 +675,38 @@ def generate_chapter(payload: GenerateChapterRequest):
 # ---------------------------
 
 @app.get("/api/projects/{project_id}/export")
-def export_project(project_id: str):
-    project = db["project"].find_one({"_id": ObjectId(project_id)})
-    if not project:
+async def export_project(project_id: str, db=Depends(get_db)):
+    # Project and its ordered chapters in one round trip
+    pipeline = [
+        {"$match": {"_id": _oid(project_id)}},
+        {"$lookup": {
+            "from": "chapter",
+            "let": {"pid": {"$toString": "$_id"}},
+            "pipeline": [
+                {"$match": {"$expr": {"$eq": ["$project_id", "$$pid"]}}},
+                {"$sort": {"number": 1}},
+                {"$project": {"_id": 0, "number": 1, "title": 1, "content": 1}},
+            ],
+            "as": "chapters",
+        }},
+        {"$project": {"title": 1, "chapters": 1}},
+    ]
+    found = await db["project"].aggregate(pipeline).to_list(1)
+    if not found:
         raise HTTPException(status_code=404, detail="Project not found")
-    chapters = list(db["chapter"].find({"project_id": project_id}).sort("number", 1))
-    parts = []
+    project = found[0]
     title = project.get('title') or 'Untitled Project'
-    parts.append(f"# {title}\n")
-    for ch in chapters:
-        ch_title = ch.get("title") or f"Chapter {ch.get('number')}"
-        content = ch.get("content", "").strip()
-        parts.append(f"\n## {ch_title}\n\n{content}\n")
-    export_text = "\n".join(parts).strip()
     filename = f"{(title or 'manuscript').replace(' ', '_').lower()}.md"
-    return {"filename": filename, "content": export_text}
+
+    # The $lookup already holds the whole manuscript in memory; join it once and send it as is
+    parts = [f"# {title}\n"]
+    for ch in project["chapters"]:
+        ch_title = ch.get("title") or f"Chapter {ch.get('number')}"
+        content = (ch.get("content") or "").strip()
+        parts.append(f"\n\n## {ch_title}\n\n{content}\n")
+
+    return Response(
+        "".join(parts),
+        media_type="text/markdown",
+        headers={"Content-Disposition": f"attachment; filename*=UTF-8''{quote(filename)}"},
+    )
@@ -0,0 +1,11 @@
+#!/bin/bash
+echo "Starting FastAPI backend server (gunicorn)..."
+
+mkdir -p logs
+# Each worker holds its own Mongo pool plus client sockets
+ulimit -n 65535 2>/dev/null || true
+echo "Installing dependencies..."
+pip install -r requirements.txt
+echo "Starting gunicorn with uvicorn workers..."
+nohup gunicorn main:app -c gunicorn.conf.py > logs/server.log 2>&1 &
+echo "Server started in background"